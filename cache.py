@@ -0,0 +1,69 @@
+"""
+SQLite-backed cache of YouTube metadata.
+
+Stores the JSON-serialisable results of yt-dlp extractions keyed by their
+YouTube ID, so resubmitting the same link does not hit YouTube again until the
+entry expires.  Nothing is cached until :func:`init_cache` has been called.
+"""
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Playlist contents change far more often than video metadata.
+PLAYLIST_TTL = 60 * 60  # seconds
+
+_conn: sqlite3.Connection | None = None
+_lock = threading.Lock()
+
+
+def init_cache(path: str) -> None:
+    """Open (creating if needed) the cache database at *path*."""
+    global _conn
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS metadata ("
+        "yt_id TEXT PRIMARY KEY, fetched_at INTEGER NOT NULL, info TEXT NOT NULL)"
+    )
+    conn.commit()
+    _conn = conn
+
+
+def get(yt_id: str, ttl: int) -> dict | None:
+    """Return the cached info for *yt_id*, or ``None`` if missing or older than *ttl*."""
+    if _conn is None:
+        return None
+    with _lock:
+        row = _conn.execute(
+            "SELECT fetched_at, info FROM metadata WHERE yt_id = ?", (yt_id,)
+        ).fetchone()
+    if row is None or time.time() - row[0] > ttl:
+        return None
+    return json.loads(row[1])
+
+
+def put(yt_id: str, info: dict) -> None:
+    """Store *info* for *yt_id*, replacing any previous entry."""
+    if _conn is None:
+        return
+    with _lock:
+        _conn.execute(
+            "INSERT OR REPLACE INTO metadata (yt_id, fetched_at, info) VALUES (?, ?, ?)",
+            (yt_id, int(time.time()), json.dumps(info)),
+        )
+        _conn.commit()
+
+
+def delete(yt_id: str) -> bool:
+    """Remove the entry for *yt_id*.  Returns ``True`` if one existed."""
+    if _conn is None:
+        return False
+    with _lock:
+        cursor = _conn.execute("DELETE FROM metadata WHERE yt_id = ?", (yt_id,))
+        _conn.commit()
+    logger.info("Cleared cached metadata for %s", yt_id)
+    return cursor.rowcount > 0
@@ -1,28 +1,125 @@
 """
 Google Drive utility module for uploading MP3 files.
 
-Handles authentication via a Service Account, folder creation for playlists,
-duplicate detection, and file uploads with progress tracking.
+Handles authentication via a Service Account, folder creation (and caching)
+for playlists, duplicate detection, and file uploads with progress tracking.
 """
 
+import json
 import os
 import logging
+import random
+import threading
+import time
 
+import google_auth_httplib2
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload
+from googleapiclient.errors import HttpError
+from googleapiclient.http import MediaIoBaseUpload, build_http, set_user_agent
 
 logger = logging.getLogger(__name__)
 
 SCOPES = ["https://www.googleapis.com/auth/drive.file"]
 
+# Google only serves gzip-compressed responses to clients whose User-Agent
+# contains "gzip" (httplib2 already sends ``Accept-Encoding: gzip``).
+USER_AGENT = "ytdl-playlist (gzip)"
+
+# Truncated exponential backoff for Drive rate-limit errors (403 / 429).
+MAX_RETRIES = 5
+MAX_BACKOFF = 32.0  # seconds
+_RATE_LIMIT_REASONS = ("rateLimitExceeded", "userRateLimitExceeded")
+
+# Files up to this size go up in a single multipart request; larger ones use
+# a resumable session so a failed chunk does not restart the whole file.
+SIMPLE_UPLOAD_MAX_BYTES = 5 * 1024 * 1024
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+# Disk read buffer, decoupled from the HTTP chunk size above.
+READ_BUFFER_SIZE = 1024 * 1024
+
+_thread_local = threading.local()
+
+# Credentials keyed by key-file path, shared by every thread's service.
+_credentials: dict[str, service_account.Credentials] = {}
+_credentials_lock = threading.Lock()
+
+# Folder IDs keyed by ``(parent_id, folder_name)``; see load_folder_cache().
+_folder_cache: dict[tuple[str, str], str] = {}
+_folder_cache_file: str | None = None
+_folder_cache_lock = threading.Lock()
+
+
+def _get_credentials(service_account_file: str) -> service_account.Credentials:
+    """Load the Service Account credentials for *service_account_file* once.
+
+    Sharing them means the access token is fetched and refreshed once for the
+    whole process rather than once per worker thread.
+    """
+    with _credentials_lock:
+        credentials = _credentials.get(service_account_file)
+        if credentials is None:
+            credentials = service_account.Credentials.from_service_account_file(
+                service_account_file, scopes=SCOPES
+            )
+            _credentials[service_account_file] = credentials
+    return credentials
+
 
 def get_drive_service(service_account_file: str):
     """Authenticate with Google Drive using a Service Account JSON key file."""
-    credentials = service_account.Credentials.from_service_account_file(
-        service_account_file, scopes=SCOPES
+    credentials = _get_credentials(service_account_file)
+    # ``build_http`` keeps resumable-upload 308 responses from being treated
+    # as redirects, which a bare ``httplib2.Http`` would do.
+    http = google_auth_httplib2.AuthorizedHttp(credentials, http=build_http())
+    http = set_user_agent(http, USER_AGENT)
+    return build("drive", "v3", http=http)
+
+
+def get_thread_drive_service(service_account_file: str):
+    """Return a Drive service owned by the calling thread.
+
+    A service wraps a single ``httplib2.Http`` object, which is not
+    thread-safe, so every worker thread builds (and then reuses) its own.
+    """
+    service = getattr(_thread_local, "service", None)
+    if service is None:
+        service = get_drive_service(service_account_file)
+        _thread_local.service = service
+    return service
+
+
+def _is_rate_limited(exc: HttpError) -> bool:
+    """Return ``True`` if *exc* is a Drive rate-limit error worth retrying."""
+    if exc.resp.status == 429:
+        return True
+    if exc.resp.status != 403 or not isinstance(exc.error_details, list):
+        return False
+    return any(
+        isinstance(detail, dict) and detail.get("reason") in _RATE_LIMIT_REASONS
+        for detail in exc.error_details
     )
-    return build("drive", "v3", credentials=credentials)
+
+
+def _with_backoff(func):
+    """Call *func* and return its result, retrying on Drive rate-limit errors.
+
+    The delay doubles on every attempt (plus up to one second of jitter) and is
+    capped at ``MAX_BACKOFF`` seconds.  Any other error is raised immediately.
+    """
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            return func()
+        except HttpError as exc:
+            if attempt == MAX_RETRIES or not _is_rate_limited(exc):
+                raise
+            delay = min(2 ** attempt + random.random(), MAX_BACKOFF)
+            logger.warning(
+                "Drive rate limit hit (HTTP %s), retrying in %.1fs",
+                exc.resp.status,
+                delay,
+            )
+            time.sleep(delay)
 
 
 def find_file_in_folder(service, folder_id: str, filename: str) -> str | None:
@@ -33,25 +130,115 @@ def find_file_in_folder(service, folder_id: str, filename: str) -> str | None:
     query = (
         f"name = '{filename}' and '{folder_id}' in parents and trashed = false"
     )
-    results = (
-        service.files()
-        .list(q=query, spaces="drive", fields="files(id, name)", pageSize=1)
-        .execute()
+    request = service.files().list(
+        q=query, spaces="drive", fields="files(id)", pageSize=1
     )
+    results = _with_backoff(request.execute)
     files = results.get("files", [])
     return files[0]["id"] if files else None
 
 
+def list_folder_contents(service, folder_id: str) -> dict[str, str]:
+    """Return a ``{name: file_id}`` mapping of everything inside *folder_id*.
+
+    One paged listing replaces a per-file :func:`find_file_in_folder` lookup
+    when many files are uploaded into the same folder.
+    """
+    contents: dict[str, str] = {}
+    page_token = None
+    while True:
+        request = service.files().list(
+            q=f"'{folder_id}' in parents and trashed = false",
+            spaces="drive",
+            fields="nextPageToken, files(id, name)",
+            pageSize=1000,
+            pageToken=page_token,
+        )
+        results = _with_backoff(request.execute)
+        for f in results.get("files", []):
+            contents.setdefault(f["name"], f["id"])
+        page_token = results.get("nextPageToken")
+        if not page_token:
+            return contents
+
+
+def load_folder_cache(path: str) -> None:
+    """Load cached folder IDs from *path* and persist new ones back to it.
+
+    A missing or unreadable file simply starts an empty cache.
+    """
+    global _folder_cache_file
+    _folder_cache_file = path
+    try:
+        with open(path, encoding="utf-8") as f:
+            entries = json.load(f)
+        # Valid JSON of the wrong shape raises TypeError or ValueError here.
+        loaded = {
+            (parent_id, folder_name): folder_id
+            for parent_id, folder_name, folder_id in entries
+        }
+    except (OSError, TypeError, ValueError):
+        return
+    with _folder_cache_lock:
+        _folder_cache.update(loaded)
+
+
+def _save_folder_cache() -> None:
+    if not _folder_cache_file:
+        return
+    with _folder_cache_lock:
+        entries = [[p, n, fid] for (p, n), fid in _folder_cache.items()]
+        tmp_path = f"{_folder_cache_file}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(entries, f)
+            os.replace(tmp_path, _folder_cache_file)
+        except OSError as exc:
+            logger.warning("Could not save folder cache: %s", exc)
+
+
+def _remember_folder(key: tuple[str, str], folder_id: str) -> None:
+    with _folder_cache_lock:
+        _folder_cache[key] = folder_id
+    _save_folder_cache()
+
+
+def _folder_exists(service, folder_id: str) -> bool:
+    """Return ``True`` if *folder_id* still exists in Drive and is not trashed."""
+    request = service.files().get(fileId=folder_id, fields="id, trashed")
+    try:
+        folder = _with_backoff(request.execute)
+    except HttpError as exc:
+        if exc.resp.status == 404:
+            return False
+        raise
+    return not folder.get("trashed", False)
+
+
 def create_folder(service, folder_name: str, parent_folder_id: str) -> str:
     """Create a folder inside *parent_folder_id* and return its ID.
 
     If a folder with the same name already exists, its ID is returned instead
     of creating a duplicate.  This keeps the Drive tidy when the same playlist
-    is downloaded more than once.
+    is downloaded more than once.  Resolved IDs are cached, so repeat requests
+    for the same playlist only check that the folder is still there; one that
+    was deleted or trashed in Drive is looked up (or created) again.
     """
+    key = (parent_folder_id, folder_name)
+    cached = _folder_cache.get(key)
+    if cached:
+        if _folder_exists(service, cached):
+            return cached
+        logger.info(
+            "Cached folder '%s' (ID: %s) was deleted or trashed", folder_name, cached
+        )
+        with _folder_cache_lock:
+            _folder_cache.pop(key, None)
+
     existing = find_file_in_folder(service, parent_folder_id, folder_name)
     if existing:
         logger.info("Folder '%s' already exists (ID: %s)", folder_name, existing)
+        _remember_folder(key, existing)
         return existing
 
     file_metadata = {
@@ -59,9 +246,11 @@ def create_folder(service, folder_name: str, parent_folder_id: str) -> str:
         "mimeType": "application/vnd.google-apps.folder",
         "parents": [parent_folder_id],
     }
-    folder = service.files().create(body=file_metadata, fields="id").execute()
+    request = service.files().create(body=file_metadata, fields="id")
+    folder = _with_backoff(request.execute)
     folder_id = folder.get("id")
     logger.info("Created folder '%s' (ID: %s)", folder_name, folder_id)
+    _remember_folder(key, folder_id)
     return folder_id
 
 
@@ -70,6 +259,7 @@ def upload_file(
     filepath: str,
     folder_id: str,
     progress_callback=None,
+    existing_names: dict[str, str] | None = None,
 ) -> str:
     """Upload *filepath* into *folder_id* on Google Drive.
 
@@ -82,7 +272,12 @@ def upload_file(
     folder_id : str
         The Drive folder ID where the file will be placed.
     progress_callback : callable, optional
-        Called with ``(progress_fraction)`` (0.0 – 1.0) after each chunk.
+        Called with ``(progress_fraction)`` (0.0 – 1.0) after each chunk
+        (once, with ``1.0``, for files small enough to skip chunking).
+    existing_names : dict, optional
+        A ``{name: file_id}`` listing of *folder_id* (see
+        :func:`list_folder_contents`).  When given, the duplicate check uses it
+        instead of querying Drive.
 
     Returns
     -------
@@ -92,23 +287,38 @@ def upload_file(
     filename = os.path.basename(filepath)
 
     # Duplicate check — skip upload if the file already exists.
-    existing = find_file_in_folder(service, folder_id, filename)
+    if existing_names is not None:
+        existing = existing_names.get(filename)
+    else:
+        existing = find_file_in_folder(service, folder_id, filename)
     if existing:
         logger.info("File '%s' already exists in folder (ID: %s)", filename, existing)
         return existing
 
     file_metadata = {"name": filename, "parents": [folder_id]}
-    media = MediaFileUpload(filepath, mimetype="audio/mpeg", resumable=True)
+    resumable = os.path.getsize(filepath) > SIMPLE_UPLOAD_MAX_BYTES
 
-    request = service.files().create(
-        body=file_metadata, media_body=media, fields="id"
-    )
+    with open(filepath, "rb", buffering=READ_BUFFER_SIZE) as fh:
+        media = MediaIoBaseUpload(
+            fh,
+            mimetype="audio/mpeg",
+            chunksize=UPLOAD_CHUNK_SIZE,
+            resumable=resumable,
+        )
+        request = service.files().create(
+            body=file_metadata, media_body=media, fields="id"
+        )
 
-    response = None
-    while response is None:
-        status, response = request.next_chunk()
-        if status and progress_callback:
-            progress_callback(status.progress())
+        if resumable:
+            response = None
+            while response is None:
+                status, response = _with_backoff(request.next_chunk)
+                if status and progress_callback:
+                    progress_callback(status.progress())
+        else:
+            response = _with_backoff(request.execute)
+            if progress_callback:
+                progress_callback(1.0)
 
     file_id = response.get("id")
     logger.info("Uploaded '%s' → Drive ID: %s", filename, file_id)
@@ -12,16 +12,21 @@ Usage
 """
 
 import asyncio
+import concurrent.futures
+import functools
 import logging
 import os
 import re
 import shutil
 import tempfile
+import threading
+import time
 import unicodedata
+from pathlib import Path
 
 import yt_dlp
 from dotenv import load_dotenv
-from telegram import Update
+from telegram import MessageEntity, Update
 from telegram.ext import (
     ApplicationBuilder,
     CommandHandler,
@@ -30,9 +35,12 @@ from telegram.ext import (
     filters,
 )
 
+import cache
 from drive_utils import (
     create_folder,
-    get_drive_service,
+    get_thread_drive_service,
+    list_folder_contents,
+    load_folder_cache,
     upload_file,
 )
 
@@ -42,9 +50,23 @@ load_dotenv()
 # Configuration
 # ---------------------------------------------------------------------------
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN", "")
+# Root URL of a self-hosted Bot API server (e.g. ``http://localhost:8081``).
+TELEGRAM_LOCAL_API_URL = os.getenv("TELEGRAM_LOCAL_API_URL", "").rstrip("/")
 GOOGLE_DRIVE_FOLDER_ID = os.getenv("GOOGLE_DRIVE_FOLDER_ID", "")
 GOOGLE_SERVICE_ACCOUNT_FILE = os.getenv("GOOGLE_SERVICE_ACCOUNT_FILE", "service_account.json")
 COOKIES_FILE = os.getenv("COOKIES_FILE", "cookies.txt")
+# Threads for blocking work handed off from the event loop (downloads,
+# filesystem checks, Drive folder lookups).
+WORKERS = int(os.getenv("WORKERS", "8"))
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", "8"))
+DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", "3"))
+# Fragments (DASH/HLS segments) fetched in parallel within a single track.
+YDL_CONCURRENCY = int(os.getenv("YDL_CONCURRENCY", "8"))
+METADATA_CACHE_FILE = os.getenv("METADATA_CACHE_FILE", "metadata_cache.sqlite3")
+# Each of these costs an extra ffmpeg pass per track.
+EMBED_THUMBNAIL = os.getenv("EMBED_THUMBNAIL", "0") == "1"
+EMBED_METADATA = os.getenv("EMBED_METADATA", "1") == "1"
+FOLDER_CACHE_FILE = os.getenv("FOLDER_CACHE_FILE", "folder_cache.json")
 
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
@@ -55,24 +77,56 @@ logger = logging.getLogger(__name__)
 # ---------------------------------------------------------------------------
 # URL helpers
 # ---------------------------------------------------------------------------
+# Video and playlist IDs are ASCII, so ``\w`` is restricted to ASCII too.
 # Matches standard YouTube video URLs, shorts, and youtu.be short-links.
 YOUTUBE_VIDEO_RE = re.compile(
-    r"(?:https?://)?(?:www\.|m\.)?(?:youtube\.com/(?:watch\?.*v=|shorts/)|youtu\.be/)[\w\-]+"
+    r"(?:https?://)?(?:www\.|m\.)?(?:youtube\.com/(?:watch\?.*v=|shorts/)|youtu\.be/)[\w\-]+",
+    re.ASCII,
 )
 # Matches YouTube playlist URLs (must contain a ``list=`` parameter).
 YOUTUBE_PLAYLIST_RE = re.compile(
-    r"(?:https?://)?(?:www\.|m\.)?youtube\.com/(?:playlist\?|watch\?).*list=[\w\-]+"
+    r"(?:https?://)?(?:www\.|m\.)?youtube\.com/(?:playlist\?|watch\?).*list=[\w\-]+",
+    re.ASCII,
 )
 
 
+# Either of the above; the playlist pattern comes first so a ``watch?v=…&list=…``
+# link is reported as a playlist.
+_YOUTUBE_URL_RE = re.compile(
+    f"(?P<playlist>{YOUTUBE_PLAYLIST_RE.pattern})|{YOUTUBE_VIDEO_RE.pattern}",
+    re.ASCII,
+)
+
+
+def classify_url(text: str) -> tuple[bool, bool]:
+    """Return ``(is_youtube, is_playlist)`` for the first YouTube URL in *text*."""
+    # A plain substring check ("youtube.com" and "youtu.be" share the prefix)
+    # rejects ordinary chat messages without touching the regex.
+    if "youtu" not in text:
+        return False, False
+    match = _YOUTUBE_URL_RE.search(text)
+    if match is None:
+        return False, False
+    return True, match.lastgroup == "playlist"
+
+
 def is_youtube_url(text: str) -> bool:
     """Return ``True`` if *text* looks like any kind of YouTube URL."""
-    return bool(YOUTUBE_VIDEO_RE.search(text) or YOUTUBE_PLAYLIST_RE.search(text))
+    return classify_url(text)[0]
+
+
+_PLAYLIST_ID_RE = re.compile(r"[?&]list=([\w\-]+)", re.ASCII)
+
+
+def playlist_id(text: str) -> str | None:
+    """Return the ``list=`` ID from a YouTube playlist URL, if any."""
+    match = _PLAYLIST_ID_RE.search(text)
+    return match.group(1) if match else None
 
 
 def is_playlist_url(text: str) -> bool:
     """Return ``True`` if *text* is specifically a YouTube *playlist* URL."""
-    return bool(YOUTUBE_PLAYLIST_RE.search(text))
+    return classify_url(text)[1]
 
 
 # ---------------------------------------------------------------------------
@@ -88,8 +142,52 @@ _GARBAGE_RE = re.compile(
     r")\s*[\]\)]?",
     re.IGNORECASE,
 )
+# Lower-case prefixes of every ``_GARBAGE_RE`` alternative (keep in sync).
+# Titles containing none of them skip the regex entirely.
+_GARBAGE_HINTS = (
+    "official", "lyric", "music", "hd", "hq", "4k", "mv", "audio",
+    "visuali", "remaster", "live", "acoustic", "remix", "karaoke",
+)
+
+_SPECIAL_CHARS = '|/\\:*?"<>'
+_KEEP_CHARS = frozenset("-'&,.!?")
+_MULTISPACE_RE = re.compile(r"\s{2,}")
+# Garbage tags and whitespace runs in a single scan, for titles that need both.
+_GARBAGE_OR_SPACE_RE = re.compile(
+    rf"({_GARBAGE_RE.pattern})|{_MULTISPACE_RE.pattern}", re.IGNORECASE
+)
+
+
+def _garbage_or_space(match: re.Match) -> str:
+    return "" if match.group(1) is not None else " "
+
 
-_SPECIAL_CHARS_RE = re.compile(r'[|/\\:*?"<>]')
+def _translation(codepoint: int) -> int | None:
+    """Return ``None`` for characters to delete from titles, else *codepoint*."""
+    ch = chr(codepoint)
+    drop = ch in _SPECIAL_CHARS or (
+        unicodedata.category(ch)[0] in ("S", "C")  # Symbol / Control
+        and ch not in _KEEP_CHARS
+    )
+    return None if drop else codepoint
+
+
+class _SanitizeTable(dict):
+    """``str.translate`` table deleting symbols, controls and unsafe characters.
+
+    Entries outside the pre-filled range are computed on first use and
+    memoised, so the table never has to cover all of Unicode up front.
+    """
+
+    def __missing__(self, codepoint: int):
+        value = self[codepoint] = _translation(codepoint)
+        return value
+
+
+# Basic Latin + Latin-1 cover most titles, so they are filled in up front.
+_SANITIZE_TABLE = _SanitizeTable({cp: _translation(cp) for cp in range(0x100)})
+# The same deletions for pure-ASCII titles, applied with bytes.translate.
+_ASCII_DROP = bytes(cp for cp in range(0x80) if _translation(cp) is None)
 
 
 def sanitize_filename(name: str) -> str:
@@ -100,116 +198,254 @@ def sanitize_filename(name: str) -> str:
     * Removes dangerous filesystem characters.
     * Collapses redundant whitespace and trims.
     """
-    # Remove emoji and symbols outside Basic Latin + Latin Supplement.
-    name = "".join(
-        ch for ch in name
-        if unicodedata.category(ch)[0] not in ("S", "C")  # Symbol / Control
-        or ch in ("-", "'", "&", ",", ".", "!", "?")
-    )
-    name = _GARBAGE_RE.sub("", name)
-    name = _SPECIAL_CHARS_RE.sub("", name)
-    name = re.sub(r"\s{2,}", " ", name).strip(" -_()")
-    return name
+    if name.isascii():
+        # Several times faster than str.translate on the common case.
+        name = name.encode("ascii").translate(None, _ASCII_DROP).decode("ascii")
+    else:
+        name = name.translate(_SANITIZE_TABLE)
+    lowered = name.lower()
+    if any(hint in lowered for hint in _GARBAGE_HINTS):
+        name = _GARBAGE_OR_SPACE_RE.sub(_garbage_or_space, name)
+    else:
+        name = _MULTISPACE_RE.sub(" ", name)
+    return name.strip(" -_()")
 
 
 # ---------------------------------------------------------------------------
 # yt-dlp download helpers
 # ---------------------------------------------------------------------------
-def _ydl_opts(output_dir: str) -> dict:
-    """Return yt-dlp options for best-audio → MP3 at 192 kbps."""
+# Most filesystems cap a name at 255 bytes; leave room for " (n).mp3".
+MAX_FILENAME_BYTES = 200
+
+
+def _truncate_bytes(name: str, limit: int) -> str:
+    """Cut *name* to at most *limit* UTF-8 bytes without splitting a character."""
+    encoded = name.encode("utf-8")
+    if len(encoded) <= limit:
+        return name
+    return encoded[:limit].decode("utf-8", errors="ignore").rstrip()
+
+
+@functools.lru_cache(maxsize=None)
+def _ydl_base_opts(embed_thumbnail: bool) -> dict:
+    """Build the download-independent part of the yt-dlp options once."""
     opts: dict = {
         "format": "bestaudio/best",
-        "outtmpl": os.path.join(output_dir, "%(title)s.%(ext)s"),
         "postprocessors": [
             {
                 "key": "FFmpegExtractAudio",
                 "preferredcodec": "mp3",
                 "preferredquality": "192",
             },
-            {"key": "FFmpegMetadata"},
-            {"key": "EmbedThumbnail"},
         ],
-        "writethumbnail": True,
         "quiet": True,
         "no_warnings": True,
-        "noplaylist": False,
+        # Every download is a single video; playlists are listed separately
+        # with _LISTING_OPTS and their entries downloaded one by one.
+        "noplaylist": True,
+        "concurrent_fragment_downloads": YDL_CONCURRENCY,
     }
+    # aria2c splits plain (non-fragmented) HTTP downloads over several
+    # connections as well.
+    if shutil.which("aria2c"):
+        opts["external_downloader"] = {"http": "aria2c"}
+        opts["external_downloader_args"] = {
+            "aria2c": ["-x", "16", "-s", "16", "-k", "1M"]
+        }
+    # Audio extraction alone writes no ID3 tags; the title/artist tags come
+    # from FFmpegMetadata.
+    if EMBED_METADATA:
+        opts["postprocessors"].append({"key": "FFmpegMetadata"})
+    if EMBED_THUMBNAIL and embed_thumbnail:
+        opts["postprocessors"].append({"key": "EmbedThumbnail"})
+        opts["writethumbnail"] = True
+    return opts
+
+
+# Overrides for the playlist listing only: entries are listed (ID, title, URL)
+# up front and each one is resolved just before it downloads.
+_LISTING_OPTS = {
+    "noplaylist": False,
+    "extract_flat": "in_playlist",
+    "lazy_playlist": True,
+}
+
+
+def _ydl_opts(output_dir: str, embed_thumbnail: bool = True) -> dict:
+    """Return yt-dlp options for best-audio → MP3 at 192 kbps.
+
+    Cover art is embedded only if ``EMBED_THUMBNAIL`` is on and the caller
+    passes *embed_thumbnail*.
+    """
+    base = _ydl_base_opts(embed_thumbnail)
+    opts = {
+        **base,
+        # Named by video ID so parallel downloads never collide; each track is
+        # renamed to its sanitized title once it is finished.
+        "outtmpl": os.path.join(output_dir, "%(id)s.%(ext)s"),
+        # Copied so yt-dlp can never modify the cached list.
+        "postprocessors": list(base["postprocessors"]),
+    }
+    # Checked per call so a cookies.txt added later is used without a restart.
     if os.path.isfile(COOKIES_FILE):
         opts["cookiefile"] = COOKIES_FILE
     return opts
 
 
+class _TrackReadyPP(yt_dlp.postprocessor.PostProcessor):
+    """Hand each track to *callback* once yt-dlp has fully finished with it."""
+
+    def __init__(self, callback):
+        super().__init__()
+        self._callback = callback
+
+    def run(self, info):
+        self._callback(info)
+        return [], info
+
+
 async def download_audio(
     url: str,
     output_dir: str,
     progress_callback=None,
+    on_track_ready=None,
+    embed_thumbnail: bool = True,
+    stop_event: threading.Event | None = None,
 ) -> list[dict]:
     """Download audio from *url* into *output_dir*.
 
-    Returns a list of dicts ``{"filepath": ..., "title": ..., "playlist": ...}``
-    for each downloaded track.
+    Returns a list of dicts ``{"filepath": ..., "title": ..., "playlist": ...,
+    "total": ...}`` for each downloaded track, where ``total`` is the number of
+    entries in the playlist (1 for a single video).
 
     The *progress_callback*, if provided, is called with
-    ``(current_index, total, title)`` whenever a new track starts downloading.
-    """
-    opts = _ydl_opts(output_dir)
+    ``(current_index, total, title)`` whenever a track finishes.
 
-    results: list[dict] = []
+    The *on_track_ready* callback, if provided, is called with each track dict
+    as soon as its MP3 is final, while the rest of a playlist is still
+    downloading.  Both callbacks run on download worker threads.
 
-    def _progress_hook(d):
-        if d["status"] == "finished" and progress_callback:
-            # yt-dlp fires this per file; we accumulate results below.
-            pass
+    *embed_thumbnail* is passed on to :func:`_ydl_opts`.
 
-    opts["progress_hooks"] = [_progress_hook]
+    Once *stop_event* is set, entries that have not started yet are skipped
+    and only the tracks finished so far are returned.
 
-    loop = asyncio.get_event_loop()
+    Playlists are listed first and their entries then downloaded
+    ``DOWNLOAD_WORKERS`` at a time.
+    """
+    opts = _ydl_opts(output_dir, embed_thumbnail)
+
+    # Tracks keyed by playlist position, as downloads may finish out of order.
+    results: dict[int, dict] = {}
+    seen_paths: set[str] = set()
+    lock = threading.Lock()
+
+    loop = asyncio.get_running_loop()
+
+    def _finalize_track(entry, position, playlist_name, total):
+        clean = sanitize_filename(entry.get("title", "Unknown"))
+        stem = _truncate_bytes(clean, MAX_FILENAME_BYTES)
+        with lock:
+            # yt-dlp reports the exact on-disk path of the converted MP3.
+            original_path = entry["filepath"]
+            final_path = os.path.join(output_dir, f"{stem}.mp3")
+            # Two entries may sanitize to the same name; keep both files.
+            suffix = 2
+            while final_path in seen_paths:
+                final_path = os.path.join(output_dir, f"{stem} ({suffix}).mp3")
+                suffix += 1
+            if original_path != final_path:
+                os.rename(original_path, final_path)
+            seen_paths.add(final_path)
+
+            track = {
+                "filepath": final_path,
+                "title": clean,
+                "playlist": playlist_name,
+                "total": total,
+            }
+            results[position] = track
+            current = len(results)
+        if progress_callback:
+            progress_callback(current, total, clean)
+        if on_track_ready:
+            on_track_ready(track)
+
+    # YoutubeDL instances are not thread-safe, so every download thread keeps
+    # its own and reuses it (and its open connections) for later entries.
+    local = threading.local()
+    instances: list[yt_dlp.YoutubeDL] = []
+
+    def _thread_ydl() -> yt_dlp.YoutubeDL:
+        ydl = getattr(local, "ydl", None)
+        if ydl is None:
+            ydl = yt_dlp.YoutubeDL(opts)
+            # Runs after conversion and tagging are complete.
+            ydl.add_post_processor(
+                _TrackReadyPP(lambda info: _finalize_track(info, *local.current)),
+                when="after_move",
+            )
+            local.ydl = ydl
+            with lock:
+                instances.append(ydl)
+        return ydl
+
+    def _download_one(video_url, position, playlist_name, total):
+        if stop_event is not None and stop_event.is_set():
+            return
+        local.current = (position, playlist_name, total)
+        _thread_ydl().extract_info(video_url, download=True)
 
     def _do_download():
-        with yt_dlp.YoutubeDL(opts) as ydl:
-            info = ydl.extract_info(url, download=True)
-            entries = info.get("entries") or [info]
-            playlist_title = info.get("title") if info.get("entries") else None
-
-            for idx, entry in enumerate(entries, 1):
-                if entry is None:
-                    continue
-                raw_title = entry.get("title", "Unknown")
-                clean = sanitize_filename(raw_title)
-                ext = "mp3"
-                # yt-dlp writes <original_title>.mp3 after conversion.
-                original_path = os.path.join(
-                    output_dir, f"{entry.get('title', raw_title)}.{ext}"
-                )
-                final_name = f"{clean}.{ext}"
-                final_path = os.path.join(output_dir, final_name)
-                # Rename to sanitized name (if the file exists).
-                if os.path.isfile(original_path) and original_path != final_path:
-                    os.rename(original_path, final_path)
-                elif not os.path.isfile(final_path):
-                    # Fallback: search for any .mp3 that matches loosely.
-                    for f in os.listdir(output_dir):
-                        if f.endswith(".mp3") and f not in [
-                            r["filepath"] for r in results
-                        ]:
-                            final_path = os.path.join(output_dir, f)
-                            final_name = f
-                            break
-
-                results.append(
-                    {
-                        "filepath": final_path,
-                        "title": clean,
-                        "playlist": sanitize_filename(playlist_title)
-                        if playlist_title
-                        else None,
-                    }
-                )
-                if progress_callback:
-                    progress_callback(idx, len(entries), clean)
+        try:
+            _download_all()
+        finally:
+            for ydl in instances:
+                ydl.close()
+
+    def _download_all():
+        # Any link carrying a ``list=`` ID, including ``youtu.be/<id>?list=…``,
+        # is listed first; yt-dlp resolves all of them to the playlist.
+        list_id = playlist_id(url)
+        if list_id is None:
+            _download_one(url, 0, None, 1)
+            return
+
+        # Phase 1: a flat listing of the playlist, without resolving entries.
+        # Per-video extraction cannot be cached like this: every download
+        # needs fresh (short-lived) stream URLs.
+        listing = cache.get(list_id, cache.PLAYLIST_TTL)
+        if listing is None:
+            with yt_dlp.YoutubeDL({**opts, **_LISTING_OPTS}) as ydl:
+                info = ydl.extract_info(url, download=False)
+            if info.get("_type") != "playlist":
+                _download_one(url, 0, None, 1)
+                return
+            listing = {
+                "title": info.get("title"),
+                "entries": [e["url"] for e in info.get("entries") or [] if e],
+            }
+            cache.put(list_id, listing)
+        entry_urls = listing["entries"]
+        # Sanitized once here rather than again for every entry.
+        playlist_name = sanitize_filename(listing["title"]) if listing["title"] else None
+
+        # Phase 2: resolve and download the entries on a few threads at once.
+        pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=DOWNLOAD_WORKERS, thread_name_prefix="ytdl-download"
+        )
+        try:
+            futures = [
+                pool.submit(_download_one, u, position, playlist_name, len(entry_urls))
+                for position, u in enumerate(entry_urls)
+            ]
+            for future in futures:
+                future.result()
+        finally:
+            pool.shutdown(cancel_futures=True)
 
     await loop.run_in_executor(None, _do_download)
-    return results
+    return [results[position] for position in sorted(results)]
 
 
 # ---------------------------------------------------------------------------
@@ -220,12 +456,206 @@ def _bar(fraction: float, width: int = 20) -> str:
     return "█" * filled + "░" * (width - filled)
 
 
-async def _edit_progress(message, text: str) -> None:
-    """Edit a Telegram message, silently ignoring 'message is not modified'."""
+# Telegram rate-limits edits to roughly one per second per chat; stay a little
+# under that so bursts of progress never trigger a RetryAfter.
+_EDIT_INTERVAL = 1.1
+
+
+class ProgressThrottler:
+    """Coalesce edits of one status message to one per ``_EDIT_INTERVAL``.
+
+    Text pushed too soon after the previous edit is held back and sent once
+    the interval has passed, replacing any text that was already waiting, so
+    the latest progress is always shown eventually.
+    """
+
+    def __init__(self, message, interval: float = _EDIT_INTERVAL):
+        self._message = message
+        self._interval = interval
+        self._last_edit = float("-inf")
+        self._pending: str | None = None
+        self._flush_task: asyncio.Task | None = None
+        # Edits go out one at a time, in the order they were requested, so an
+        # edit still on the wire can never land after a newer one.
+        self._edit_lock = asyncio.Lock()
+
+    async def push(self, text: str, force: bool = False) -> None:
+        """Show *text* now if allowed, otherwise as soon as the interval ends.
+
+        *force* edits immediately regardless of the interval; callers use it
+        for final and error states.
+        """
+        wait = self._last_edit + self._interval - time.monotonic()
+        if force or wait <= 0:
+            self.close()
+            await self._edit(text)
+            return
+        self._pending = text
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_later(wait))
+
+    def close(self) -> None:
+        """Discard any held-back edit."""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        self._pending = None
+
+    async def _flush_later(self, delay: float) -> None:
+        try:
+            while True:
+                await asyncio.sleep(delay)
+                text, self._pending = self._pending, None
+                if text is None:
+                    return
+                # Shielded: cancelling the flush must not abandon a request
+                # that may already have reached Telegram.
+                await asyncio.shield(self._edit(text))
+                delay = self._interval
+        finally:
+            if self._flush_task is asyncio.current_task():
+                self._flush_task = None
+
+    async def _edit(self, text: str) -> None:
+        """Edit the message, silently ignoring 'message is not modified'."""
+        async with self._edit_lock:
+            self._last_edit = time.monotonic()
+            try:
+                await self._message.edit_text(text, parse_mode="HTML")
+            except Exception:
+                pass
+
+
+# ---------------------------------------------------------------------------
+# Google Drive upload helpers
+# ---------------------------------------------------------------------------
+# Installed as the event loop's default executor in _post_init(), so
+# ``run_in_executor(None, ...)`` and ``asyncio.to_thread`` share one bounded pool.
+_executor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=WORKERS, thread_name_prefix="ytdl"
+)
+# Uploads are independent network I/O, so up to ``UPLOAD_WORKERS`` of them run
+# at once; further tracks wait in the pool's queue.
+_upload_executor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=UPLOAD_WORKERS, thread_name_prefix="drive-upload"
+)
+
+
+def _upload_track(
+    filepath: str, folder_id: str, existing_names: dict[str, str]
+) -> str:
+    """Upload *filepath* using the calling worker thread's own Drive service."""
+    service = get_thread_drive_service(GOOGLE_SERVICE_ACCOUNT_FILE)
+    return upload_file(service, filepath, folder_id, existing_names=existing_names)
+
+
+def _resolve_folder(playlist_name: str | None) -> tuple[str, dict[str, str]]:
+    """Return the upload folder for a message and the names already in it.
+
+    A playlist gets a sub-folder named after it.  The folder is listed once up
+    front instead of running a duplicate-check query per track.
+    """
+    service = get_thread_drive_service(GOOGLE_SERVICE_ACCOUNT_FILE)
+    folder_id = GOOGLE_DRIVE_FOLDER_ID
+    if playlist_name:
+        folder_id = create_folder(service, playlist_name, GOOGLE_DRIVE_FOLDER_ID)
+    return folder_id, list_folder_contents(service, folder_id)
+
+
+async def _upload_worker(
+    queue: asyncio.Queue, progress: ProgressThrottler, playlist: bool
+) -> None:
+    """Upload tracks from *queue* to Drive until a ``None`` sentinel arrives.
+
+    The target folder is resolved from the first track, so uploads start while
+    the rest of a playlist is still downloading.  The worker fails as soon as
+    any upload does.  If it fails or is cancelled, its remaining uploads are
+    cancelled and waited for, so none of them outlives the message's
+    temporary files.
+    """
+    target_folder = None
+    existing_names: dict[str, str] = {}
+    uploads: list[asyncio.Task] = []
+    uploaded = 0
+    # Resolved with the first upload error, so the worker stops right away
+    # instead of only noticing once the sentinel arrives.
+    failed: asyncio.Future = asyncio.get_running_loop().create_future()
+
+    def _upload_done(task: asyncio.Task) -> None:
+        if not task.cancelled() and task.exception() and not failed.done():
+            failed.set_result(task.exception())
+
+    async def _next_track():
+        get = asyncio.ensure_future(queue.get())
+        try:
+            await asyncio.wait({get, failed}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            if not get.done():
+                get.cancel()
+        if failed.done():
+            raise failed.result()
+        return get.result()
+
+    async def _upload(t):
+        nonlocal uploaded
+        future = _upload_executor.submit(
+            _upload_track, t["filepath"], target_folder, existing_names
+        )
+        try:
+            await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            # An upload already running on its thread cannot be stopped; wait
+            # for it so the file is not deleted underneath it.
+            if not future.cancel():
+                await asyncio.gather(
+                    asyncio.wrap_future(future), return_exceptions=True
+                )
+            raise
+        uploaded += 1
+        # Measured against the whole playlist, which is still downloading.
+        total = t["total"]
+        await progress.push(
+            f"⬆️ Uploaded <b>{t['title']}</b>\n"
+            f"{_bar(uploaded / total)} {uploaded}/{total}",
+        )
+
     try:
-        await message.edit_text(text, parse_mode="HTML")
-    except Exception:
-        pass
+        while (t := await _next_track()) is not None:
+            if target_folder is None:
+                target_folder, existing_names = await asyncio.to_thread(
+                    _resolve_folder, t["playlist"] if playlist else None
+                )
+            if await asyncio.to_thread(os.path.isfile, t["filepath"]):
+                task = asyncio.create_task(_upload(t))
+                task.add_done_callback(_upload_done)
+                uploads.append(task)
+
+        await asyncio.gather(*uploads)
+    finally:
+        for task in uploads:
+            task.cancel()
+        await asyncio.gather(*uploads, return_exceptions=True)
+
+
+# PTB's 20 s default write timeout is too short for multi-megabyte MP3s on a
+# slow uplink.
+SEND_READ_TIMEOUT = 120
+SEND_WRITE_TIMEOUT = 600
+
+
+async def _send_worker(queue: asyncio.Queue, message) -> None:
+    """Send tracks from *queue* to the chat until a ``None`` sentinel arrives.
+
+    Tracks are sent in the order they finish downloading.
+    """
+    while (t := await queue.get()) is not None:
+        if await asyncio.to_thread(os.path.isfile, t["filepath"]):
+            await message.reply_audio(
+                audio=Path(t["filepath"]),
+                title=t["title"],
+                read_timeout=SEND_READ_TIMEOUT,
+                write_timeout=SEND_WRITE_TIMEOUT,
+            )
 
 
 # ---------------------------------------------------------------------------
@@ -254,19 +684,58 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "  - https://youtube.com/watch?v=...\n"
         "  - https://youtu.be/...\n"
         "  - https://youtube.com/shorts/...\n"
-        "  - https://youtube.com/playlist?list=...\n",
+        "  - https://youtube.com/playlist?list=...\n\n"
+        "Playlist contents are cached for an hour. Send "
+        "<code>/refresh &lt;playlist link&gt;</code> to fetch a playlist again "
+        "right away.",
         parse_mode="HTML",
     )
 
 
+async def refresh_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /refresh <playlist url> — forget a cached playlist listing."""
+    list_id = playlist_id(" ".join(context.args)) if context.args else None
+    if not list_id:
+        await update.message.reply_text(
+            "Usage: <code>/refresh &lt;playlist link&gt;</code>",
+            parse_mode="HTML",
+        )
+    elif await asyncio.to_thread(cache.delete, list_id):
+        await update.message.reply_text(
+            "🔄 Cleared. The playlist will be fetched again on the next download."
+        )
+    else:
+        await update.message.reply_text("ℹ️ Nothing was cached for that playlist.")
+
+
+def _extract_url(message) -> str:
+    """Return the first YouTube link in *message*, else its stripped text.
+
+    Telegram has already located the links in the message entities, so only
+    those are matched rather than the whole text (which may be pasted lyrics).
+    """
+    entities = message.parse_entities([MessageEntity.URL, MessageEntity.TEXT_LINK])
+    for entity, text in entities.items():
+        url = entity.url if entity.type == MessageEntity.TEXT_LINK else text
+        if is_youtube_url(url):
+            return url
+    return message.text.strip()
+
+
+# Fire-and-forget tasks; the event loop only keeps weak references to them.
+_background_tasks: set[asyncio.Task] = set()
+
+
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Process an incoming text message — the main bot logic."""
-    text = update.message.text.strip()
+    loop = asyncio.get_running_loop()
+    text = _extract_url(update.message)
 
     # ------------------------------------------------------------------
     # 1. Input validation
     # ------------------------------------------------------------------
-    if not is_youtube_url(text):
+    youtube, playlist = classify_url(text)
+    if not youtube:
         await update.message.reply_text(
             "🚫 Sorry, I only accept <b>YouTube</b> links.\n"
             "Please send a valid YouTube video, short, or playlist URL.",
@@ -274,32 +743,59 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
 
-    playlist = is_playlist_url(text)
     kind = "playlist" if playlist else "video"
     status_msg = await update.message.reply_text(
         f"⏳ Received a YouTube <b>{kind}</b> link. Starting download…",
         parse_mode="HTML",
     )
 
+    drive_enabled = bool(GOOGLE_DRIVE_FOLDER_ID) and await asyncio.to_thread(
+        os.path.isfile, GOOGLE_SERVICE_ACCOUNT_FILE
+    )
+    progress = ProgressThrottler(status_msg)
+    queue: asyncio.Queue = asyncio.Queue()
+    consumer = None
+
     tmpdir = tempfile.mkdtemp(prefix="ytdl_")
     try:
         # ------------------------------------------------------------------
-        # 2. Download
+        # 2. Download, delivering each track as soon as it is finished
         # ------------------------------------------------------------------
         def _dl_progress(current, total, title):
             # Fire-and-forget an async edit from the sync callback.
             pct = current / total if total else 0
-            asyncio.get_event_loop().call_soon_threadsafe(
-                asyncio.ensure_future,
-                _edit_progress(
-                    status_msg,
-                    f"⬇️ Downloading <b>{title}</b>\n"
+            asyncio.run_coroutine_threadsafe(
+                progress.push(
+                    f"⬇️ Downloaded <b>{title}</b>\n"
                     f"{_bar(pct)} {current}/{total}",
                 ),
+                loop,
             )
 
+        def _track_ready(track):
+            loop.call_soon_threadsafe(queue.put_nowait, track)
+
+        if drive_enabled:
+            consumer = asyncio.create_task(_upload_worker(queue, progress, playlist))
+        else:
+            # No Drive config → send files directly to the user.
+            consumer = asyncio.create_task(_send_worker(queue, update.message))
+        # Before the sentinel the consumer only ends by failing, and then
+        # nobody is left to receive the remaining tracks.
+        stop = threading.Event()
+        consumer.add_done_callback(lambda _: stop.set())
+
         try:
-            tracks = await download_audio(text, tmpdir, progress_callback=_dl_progress)
+            tracks = await download_audio(
+                text,
+                tmpdir,
+                progress_callback=_dl_progress,
+                on_track_ready=_track_ready,
+                # Cover art is only worth an extra ffmpeg pass for files
+                # kept on Drive.
+                embed_thumbnail=drive_enabled,
+                stop_event=stop,
+            )
         except yt_dlp.utils.DownloadError as exc:
             msg = str(exc).lower()
             if "private" in msg:
@@ -315,75 +811,82 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 )
             else:
                 friendly = f"⚠️ Download error: {exc}"
-            await _edit_progress(status_msg, friendly)
+            await progress.push(friendly, force=True)
             return
 
         if not tracks:
-            await _edit_progress(status_msg, "⚠️ No tracks were downloaded.")
+            await progress.push("⚠️ No tracks were downloaded.", force=True)
             return
 
-        await _edit_progress(
-            status_msg,
-            f"✅ Downloaded <b>{len(tracks)}</b> track(s). Starting upload…",
-        )
-
         # ------------------------------------------------------------------
-        # 3. Upload to Google Drive
+        # 3. Wait for the remaining uploads / sends
         # ------------------------------------------------------------------
-        if not GOOGLE_DRIVE_FOLDER_ID or not os.path.isfile(GOOGLE_SERVICE_ACCOUNT_FILE):
-            # No Drive config → send files directly to the user.
-            for t in tracks:
-                if os.path.isfile(t["filepath"]):
-                    with open(t["filepath"], "rb") as audio_file:
-                        await update.message.reply_audio(
-                            audio=audio_file,
-                            title=t["title"],
-                        )
-            await _edit_progress(
-                status_msg, "✅ Done! Files sent directly (Google Drive not configured)."
+        if not consumer.done():
+            pending = "Finishing uploads…" if drive_enabled else "Sending files…"
+            await progress.push(
+                f"✅ Downloaded <b>{len(tracks)}</b> track(s). {pending}",
+                force=True,
             )
+        queue.put_nowait(None)
+        try:
+            await consumer
+        except Exception as exc:
+            logger.exception("Delivering tracks failed")
+            action = "Upload to Google Drive" if drive_enabled else "Sending files"
+            await progress.push(f"⚠️ {action} failed: {exc}", force=True)
             return
+        finally:
+            consumer = None
 
-        service = get_drive_service(GOOGLE_SERVICE_ACCOUNT_FILE)
-        target_folder = GOOGLE_DRIVE_FOLDER_ID
-
-        # If it is a playlist, create a sub-folder named after the playlist.
-        playlist_name = tracks[0].get("playlist")
-        if playlist and playlist_name:
-            target_folder = create_folder(service, playlist_name, GOOGLE_DRIVE_FOLDER_ID)
-
-        for idx, t in enumerate(tracks, 1):
-            if not os.path.isfile(t["filepath"]):
-                continue
-            pct = idx / len(tracks)
-            await _edit_progress(
-                status_msg,
-                f"⬆️ Uploading <b>{t['title']}</b>\n"
-                f"{_bar(pct)} {idx}/{len(tracks)}",
-            )
-            upload_file(service, t["filepath"], target_folder)
-
-        await _edit_progress(
-            status_msg,
-            f"✅ All done! <b>{len(tracks)}</b> track(s) uploaded to Google Drive.",
-        )
+        if drive_enabled:
+            done = f"✅ All done! <b>{len(tracks)}</b> track(s) uploaded to Google Drive."
+        else:
+            done = "✅ Done! Files sent directly (Google Drive not configured)."
+        await progress.push(done, force=True)
 
     finally:
-        # Clean up temporary files.
-        shutil.rmtree(tmpdir, ignore_errors=True)
+        if consumer:
+            consumer.cancel()
+            # Wait for the consumer to wind down before its files are removed.
+            await asyncio.gather(consumer, return_exceptions=True)
+        progress.close()
+        # Clean up temporary files in the background so a large playlist
+        # directory does not hold up the next update.
+        cleanup = asyncio.create_task(
+            asyncio.to_thread(shutil.rmtree, tmpdir, ignore_errors=True)
+        )
+        _background_tasks.add(cleanup)
+        cleanup.add_done_callback(_background_tasks.discard)
 
 
 # ---------------------------------------------------------------------------
 # Entry point
 # ---------------------------------------------------------------------------
+async def _post_init(app) -> None:
+    asyncio.get_running_loop().set_default_executor(_executor)
+
+
 def main() -> None:
     if not TELEGRAM_BOT_TOKEN:
         logger.error("TELEGRAM_BOT_TOKEN is not set. Check your .env file.")
         return
 
-    app = ApplicationBuilder().token(TELEGRAM_BOT_TOKEN).build()
+    load_folder_cache(FOLDER_CACHE_FILE)
+    cache.init_cache(METADATA_CACHE_FILE)
+
+    builder = ApplicationBuilder().token(TELEGRAM_BOT_TOKEN).post_init(_post_init)
+    if TELEGRAM_LOCAL_API_URL:
+        # A local Bot API server reads sent files straight from disk
+        # (file:// URIs) and raises the upload limit from 50 MB to 2 GB.
+        builder = (
+            builder.base_url(f"{TELEGRAM_LOCAL_API_URL}/bot")
+            .base_file_url(f"{TELEGRAM_LOCAL_API_URL}/file/bot")
+            .local_mode(True)
+        )
+    app = builder.build()
     app.add_handler(CommandHandler("start", start_command))
     app.add_handler(CommandHandler("help", help_command))
+    app.add_handler(CommandHandler("refresh", refresh_command))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
 
     logger.info("Bot started. Listening for messages…")
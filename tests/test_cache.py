@@ -0,0 +1,41 @@
+"""Unit tests for cache.py – SQLite metadata cache."""
+
+from unittest.mock import patch
+
+import pytest
+
+import cache
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, "_conn", None)
+    cache.init_cache(str(tmp_path / "meta.sqlite3"))
+    yield
+    cache._conn.close()
+
+
+class TestCache:
+    def test_round_trip(self, db):
+        cache.put("PL1", {"title": "Mix", "entries": ["a", "b"]})
+        assert cache.get("PL1", ttl=60) == {"title": "Mix", "entries": ["a", "b"]}
+
+    def test_missing_entry(self, db):
+        assert cache.get("PL1", ttl=60) is None
+
+    def test_expired_entry(self, db):
+        with patch("cache.time.time", return_value=1000):
+            cache.put("PL1", {"title": "Mix"})
+        with patch("cache.time.time", return_value=1000 + 61):
+            assert cache.get("PL1", ttl=60) is None
+
+    def test_delete(self, db):
+        cache.put("PL1", {"title": "Mix"})
+        assert cache.delete("PL1") is True
+        assert cache.get("PL1", ttl=60) is None
+        assert cache.delete("PL1") is False
+
+    def test_noop_before_init(self, monkeypatch):
+        monkeypatch.setattr(cache, "_conn", None)
+        cache.put("PL1", {"title": "Mix"})
+        assert cache.get("PL1", ttl=60) is None
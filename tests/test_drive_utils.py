@@ -1,9 +1,39 @@
 """Unit tests for drive_utils.py – Drive helper functions."""
 
+import threading
 from unittest.mock import MagicMock, patch
 import pytest
+import httplib2
+from googleapiclient.errors import HttpError
 
-from drive_utils import find_file_in_folder, create_folder, upload_file
+import drive_utils
+from drive_utils import (
+    find_file_in_folder,
+    create_folder,
+    get_thread_drive_service,
+    list_folder_contents,
+    load_folder_cache,
+    upload_file,
+    _with_backoff,
+)
+
+
+@pytest.fixture(autouse=True)
+def _empty_folder_cache(monkeypatch):
+    """Keep the module-level folder cache from leaking between tests."""
+    monkeypatch.setattr(drive_utils, "_folder_cache", {})
+    monkeypatch.setattr(drive_utils, "_folder_cache_file", None)
+
+
+def _http_error(status, reason=None):
+    """Build a googleapiclient HttpError with an optional Drive error reason."""
+    content = b"{}"
+    if reason:
+        content = (
+            b'{"error": {"errors": [{"reason": "%s"}], "message": "x"}}'
+            % reason.encode()
+        )
+    return HttpError(httplib2.Response({"status": status}), content)
 
 
 # -----------------------------------------------------------------------
@@ -23,6 +53,24 @@ class TestFindFileInFolder:
         assert find_file_in_folder(service, "folder1", "song.mp3") is None
 
 
+# -----------------------------------------------------------------------
+# list_folder_contents
+# -----------------------------------------------------------------------
+class TestListFolderContents:
+    def test_follows_pagination(self):
+        service = MagicMock()
+        service.files().list().execute.side_effect = [
+            {"files": [{"id": "1", "name": "a.mp3"}], "nextPageToken": "tok"},
+            {"files": [{"id": "2", "name": "b.mp3"}]},
+        ]
+        assert list_folder_contents(service, "folder1") == {"a.mp3": "1", "b.mp3": "2"}
+
+    def test_empty_folder(self):
+        service = MagicMock()
+        service.files().list().execute.return_value = {"files": []}
+        assert list_folder_contents(service, "folder1") == {}
+
+
 # -----------------------------------------------------------------------
 # create_folder
 # -----------------------------------------------------------------------
@@ -48,6 +96,66 @@ class TestCreateFolder:
         result = create_folder(service, "New Playlist", "root_id")
         assert result == "new_folder_id"
 
+    def test_second_call_uses_cache(self):
+        service = MagicMock()
+        service.files().list().execute.return_value = {"files": []}
+        service.files().create().execute.return_value = {"id": "new_folder_id"}
+        create_folder(service, "New Playlist", "root_id")
+        service.reset_mock()
+        service.files().get().execute.return_value = {
+            "id": "new_folder_id",
+            "trashed": False,
+        }
+
+        assert create_folder(service, "New Playlist", "root_id") == "new_folder_id"
+        service.files().list.assert_not_called()
+        service.files().create.assert_not_called()
+
+    @pytest.mark.parametrize(
+        "lookup",
+        [
+            {"side_effect": _http_error(404)},
+            {"return_value": {"id": "old_folder_id", "trashed": True}},
+        ],
+        ids=["deleted", "trashed"],
+    )
+    def test_stale_cached_folder_is_resolved_again(self, lookup):
+        drive_utils._folder_cache[("root_id", "New Playlist")] = "old_folder_id"
+        service = MagicMock()
+        service.files().get().execute.configure_mock(**lookup)
+        service.files().list().execute.return_value = {"files": []}
+        service.files().create().execute.return_value = {"id": "new_folder_id"}
+
+        assert create_folder(service, "New Playlist", "root_id") == "new_folder_id"
+        assert drive_utils._folder_cache == {("root_id", "New Playlist"): "new_folder_id"}
+
+    def test_cache_persists_to_disk(self, tmp_path):
+        cache_file = tmp_path / "folders.json"
+        load_folder_cache(str(cache_file))
+        service = MagicMock()
+        service.files().list().execute.return_value = {"files": []}
+        service.files().create().execute.return_value = {"id": "new_folder_id"}
+        create_folder(service, "New Playlist", "root_id")
+
+        drive_utils._folder_cache.clear()
+        load_folder_cache(str(cache_file))
+        assert drive_utils._folder_cache == {("root_id", "New Playlist"): "new_folder_id"}
+
+    def test_missing_cache_file_is_ignored(self, tmp_path):
+        load_folder_cache(str(tmp_path / "missing.json"))
+        assert drive_utils._folder_cache == {}
+
+    @pytest.mark.parametrize(
+        "content",
+        ['{"root_id": "folder_id"}', '[["root_id", "folder_id"]]', "5", '[[["a"], "b", "c"]]'],
+        ids=["dict", "short-row", "number", "unhashable"],
+    )
+    def test_malformed_cache_file_is_ignored(self, tmp_path, content):
+        cache_file = tmp_path / "folders.json"
+        cache_file.write_text(content)
+        load_folder_cache(str(cache_file))
+        assert drive_utils._folder_cache == {}
+
 
 # -----------------------------------------------------------------------
 # upload_file
@@ -65,3 +173,103 @@ class TestUploadFile:
         }
         result = upload_file(service, str(dummy), "folder_id")
         assert result == "dup_id"
+
+    def test_small_file_uses_single_request(self, tmp_path):
+        dummy = tmp_path / "song.mp3"
+        dummy.write_bytes(b"\x00" * 100)
+
+        service = MagicMock()
+        service.files().create().execute.return_value = {"id": "new_id"}
+        result = upload_file(service, str(dummy), "folder_id", existing_names={})
+        assert result == "new_id"
+        service.files().create().next_chunk.assert_not_called()
+
+    def test_large_file_uses_resumable_upload(self, tmp_path):
+        dummy = tmp_path / "song.mp3"
+        with open(dummy, "wb") as f:
+            f.truncate(drive_utils.SIMPLE_UPLOAD_MAX_BYTES + 1)
+
+        service = MagicMock()
+        service.files().create().next_chunk.return_value = (None, {"id": "new_id"})
+        result = upload_file(service, str(dummy), "folder_id", existing_names={})
+        assert result == "new_id"
+        service.files().create().execute.assert_not_called()
+
+    def test_uses_existing_names_instead_of_query(self, tmp_path):
+        """A pre-fetched folder listing replaces the per-file Drive query."""
+        dummy = tmp_path / "song.mp3"
+        dummy.write_bytes(b"\x00" * 100)
+
+        service = MagicMock()
+        result = upload_file(
+            service, str(dummy), "folder_id", existing_names={"song.mp3": "dup_id"}
+        )
+        assert result == "dup_id"
+        service.files().list.assert_not_called()
+
+
+# -----------------------------------------------------------------------
+# _with_backoff
+# -----------------------------------------------------------------------
+class TestWithBackoff:
+    @patch("drive_utils.time.sleep")
+    def test_retries_on_429_then_succeeds(self, mock_sleep):
+        func = MagicMock(side_effect=[_http_error(429), "ok"])
+        assert _with_backoff(func) == "ok"
+        assert func.call_count == 2
+        mock_sleep.assert_called_once()
+
+    @patch("drive_utils.time.sleep")
+    def test_retries_on_403_rate_limit(self, mock_sleep):
+        func = MagicMock(side_effect=[_http_error(403, "userRateLimitExceeded"), "ok"])
+        assert _with_backoff(func) == "ok"
+
+    @patch("drive_utils.time.sleep")
+    def test_does_not_retry_other_403(self, mock_sleep):
+        func = MagicMock(side_effect=_http_error(403, "insufficientFilePermissions"))
+        with pytest.raises(HttpError):
+            _with_backoff(func)
+        func.assert_called_once()
+        mock_sleep.assert_not_called()
+
+    @patch("drive_utils.time.sleep")
+    def test_gives_up_after_max_retries(self, mock_sleep):
+        func = MagicMock(side_effect=_http_error(429))
+        with pytest.raises(HttpError):
+            _with_backoff(func)
+        assert func.call_count == drive_utils.MAX_RETRIES + 1
+        assert all(
+            call.args[0] <= drive_utils.MAX_BACKOFF for call in mock_sleep.call_args_list
+        )
+
+
+# -----------------------------------------------------------------------
+# get_thread_drive_service
+# -----------------------------------------------------------------------
+class TestGetThreadDriveService:
+    @patch("drive_utils.get_drive_service", side_effect=lambda _: MagicMock())
+    def test_one_service_per_thread(self, mock_build):
+        main_service = get_thread_drive_service("sa.json")
+        assert get_thread_drive_service("sa.json") is main_service
+
+        other = []
+        worker = threading.Thread(
+            target=lambda: other.append(get_thread_drive_service("sa.json"))
+        )
+        worker.start()
+        worker.join()
+        assert other[0] is not main_service
+
+    @patch("drive_utils.service_account.Credentials.from_service_account_file")
+    def test_credentials_shared_across_threads(self, mock_load, monkeypatch):
+        monkeypatch.setattr(drive_utils, "_credentials", {})
+        creds = []
+        worker = threading.Thread(
+            target=lambda: creds.append(drive_utils._get_credentials("sa.json"))
+        )
+        worker.start()
+        worker.join()
+        creds.append(drive_utils._get_credentials("sa.json"))
+
+        assert creds[0] is creds[1]
+        mock_load.assert_called_once_with("sa.json", scopes=drive_utils.SCOPES)
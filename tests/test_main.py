@@ -1,7 +1,71 @@
 """Unit tests for main.py – URL validation & filename sanitization."""
 
+import asyncio
+import concurrent.futures
+import os
+import threading
+import time
+from unittest.mock import AsyncMock, MagicMock, patch
+
 import pytest
-from main import is_youtube_url, is_playlist_url, sanitize_filename
+import yt_dlp
+from telegram import MessageEntity
+
+import main
+from main import (
+    ProgressThrottler,
+    _extract_url,
+    _ydl_opts,
+    classify_url,
+    download_audio,
+    is_youtube_url,
+    is_playlist_url,
+    playlist_id,
+    sanitize_filename,
+)
+
+
+class _FakeYoutubeDL:
+    """Stand-in for ``yt_dlp.YoutubeDL`` that "downloads" the given titles.
+
+    Playlist URLs return a flat listing of ``video:<n>`` entries; downloading
+    ``video:<n>`` (or any single-video URL, as entry 0) writes ``<n>.mp3``.
+    """
+
+    titles: list[str] = []
+
+    def __init__(self, opts):
+        self.outdir = opts["outtmpl"].rsplit("/", 1)[0]
+        self.pps = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def close(self):
+        pass
+
+    def add_post_processor(self, pp, when="post_process"):
+        self.pps.append(pp)
+
+    def extract_info(self, url, download=True):
+        if not download:
+            return {
+                "_type": "playlist",
+                "title": "My Playlist 🎵",
+                "entries": [{"url": f"video:{i}"} for i in range(len(self.titles))],
+            }
+        idx = int(url.split(":")[1]) if url.startswith("video:") else 0
+        path = f"{self.outdir}/{idx}.mp3"
+        with open(path, "wb") as f:
+            f.write(b"\x00")
+        info = {"title": self.titles[idx], "filepath": path}
+        for pp in self.pps:
+            pp.run(info)
+        return info
 
 
 # -----------------------------------------------------------------------
@@ -30,6 +94,7 @@ class TestIsYoutubeUrl:
             "https://vimeo.com/12345",
             "not a url at all",
             "https://youtu.be/",
+            "https://youtu.be/日本語",
             "",
         ],
     )
@@ -60,6 +125,65 @@ class TestIsPlaylistUrl:
         assert is_playlist_url(url) is False
 
 
+class TestClassifyUrl:
+    @pytest.mark.parametrize(
+        "text, expected",
+        [
+            ("https://youtu.be/dQw4w9WgXcQ", (True, False)),
+            ("https://youtube.com/playlist?list=PLxyz123", (True, True)),
+            ("https://www.youtube.com/watch?v=abc&list=PLxyz123", (True, True)),
+            ("https://example.com/watch?v=abc&list=PLxyz123", (False, False)),
+            ("hello there", (False, False)),
+        ],
+    )
+    def test_classify_url(self, text, expected):
+        assert classify_url(text) == expected
+
+
+class TestPlaylistId:
+    @pytest.mark.parametrize(
+        "url, expected",
+        [
+            ("https://youtube.com/playlist?list=PLxyz123", "PLxyz123"),
+            ("https://www.youtube.com/watch?v=abc&list=PL-a_b", "PL-a_b"),
+            ("https://youtu.be/dQw4w9WgXcQ", None),
+        ],
+    )
+    def test_playlist_id(self, url, expected):
+        assert playlist_id(url) == expected
+
+
+class TestExtractUrl:
+    @staticmethod
+    def _message(text, entities):
+        message = MagicMock(text=text)
+        message.parse_entities.return_value = entities
+        return message
+
+    def test_picks_youtube_link_out_of_surrounding_text(self):
+        url = "https://youtu.be/dQw4w9WgXcQ"
+        message = self._message(
+            f"lyrics... see https://example.com or {url} thanks",
+            {
+                MessageEntity(MessageEntity.URL, 14, 19): "https://example.com",
+                MessageEntity(MessageEntity.URL, 37, len(url)): url,
+            },
+        )
+        assert _extract_url(message) == url
+
+    def test_uses_target_of_text_link(self):
+        url = "https://youtube.com/playlist?list=PLxyz123"
+        message = self._message(
+            "my playlist",
+            {MessageEntity(MessageEntity.TEXT_LINK, 3, 8, url=url): "playlist"},
+        )
+        assert _extract_url(message) == url
+
+    def test_falls_back_to_text_without_entities(self):
+        message = self._message("  https://youtu.be/dQw4w9WgXcQ \n", {})
+        assert _extract_url(message) == "https://youtu.be/dQw4w9WgXcQ"
+
+
 # -----------------------------------------------------------------------
 # Filename sanitization
 # -----------------------------------------------------------------------
@@ -95,9 +219,412 @@ class TestSanitizeFilename:
         result = sanitize_filename("  - Song Title - ")
         assert result == "Song Title"
 
+    def test_removes_emoji(self):
+        assert sanitize_filename("Artist - Song 🔥🎵") == "Artist - Song"
+
+    def test_keeps_non_latin_letters(self):
+        assert sanitize_filename("米津玄師 - Lemon (MV)") == "米津玄師 - Lemon"
+
+    def test_title_without_garbage_is_unchanged(self):
+        assert sanitize_filename("Band - Song Name") == "Band - Song Name"
+
     def test_empty_string(self):
         assert sanitize_filename("") == ""
 
     def test_preserves_basic_punctuation(self):
         result = sanitize_filename("Rock & Roll, Baby!")
         assert "Rock & Roll, Baby!" == result
+
+
+# -----------------------------------------------------------------------
+# yt-dlp options
+# -----------------------------------------------------------------------
+class TestYdlOpts:
+    @pytest.fixture(autouse=True)
+    def _fresh_ydl_opts(self):
+        """Rebuild the cached yt-dlp options for each test's patched settings."""
+        main._ydl_base_opts.cache_clear()
+        yield
+        main._ydl_base_opts.cache_clear()
+
+    @staticmethod
+    def _pp_keys(opts):
+        return [pp["key"] for pp in opts["postprocessors"]]
+
+    def test_thumbnail_off_by_default(self, tmp_path):
+        opts = _ydl_opts(str(tmp_path))
+        assert "EmbedThumbnail" not in self._pp_keys(opts)
+        assert "writethumbnail" not in opts
+
+    def test_thumbnail_enabled(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(main, "EMBED_THUMBNAIL", True)
+        opts = _ydl_opts(str(tmp_path))
+        assert self._pp_keys(opts)[-1] == "EmbedThumbnail"
+        assert opts["writethumbnail"] is True
+
+    def test_thumbnail_skipped_when_caller_opts_out(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(main, "EMBED_THUMBNAIL", True)
+        opts = _ydl_opts(str(tmp_path), embed_thumbnail=False)
+        assert "EmbedThumbnail" not in self._pp_keys(opts)
+        assert "writethumbnail" not in opts
+
+    def test_uses_aria2c_when_available(self, tmp_path):
+        with patch("main.shutil.which", return_value="/usr/bin/aria2c"):
+            opts = _ydl_opts(str(tmp_path))
+        assert opts["external_downloader"] == {"http": "aria2c"}
+
+    def test_native_downloader_without_aria2c(self, tmp_path):
+        with patch("main.shutil.which", return_value=None):
+            opts = _ydl_opts(str(tmp_path))
+        assert "external_downloader" not in opts
+        assert opts["concurrent_fragment_downloads"] == main.YDL_CONCURRENCY
+
+    def test_downloads_never_expand_playlists(self, tmp_path):
+        opts = _ydl_opts(str(tmp_path))
+        assert opts["noplaylist"] is True
+        assert "extract_flat" not in opts
+
+    def test_metadata_can_be_disabled(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(main, "EMBED_METADATA", False)
+        assert self._pp_keys(_ydl_opts(str(tmp_path))) == ["FFmpegExtractAudio"]
+
+    def test_base_options_are_built_once(self, tmp_path):
+        with patch("main.shutil.which", return_value=None) as which:
+            first = _ydl_opts(str(tmp_path / "a"))
+            second = _ydl_opts(str(tmp_path / "b"))
+        which.assert_called_once()
+        assert first["outtmpl"] != second["outtmpl"]
+        assert first["postprocessors"] is not second["postprocessors"]
+
+
+# -----------------------------------------------------------------------
+# download_audio
+# -----------------------------------------------------------------------
+class TestDownloadAudio:
+    def test_renames_to_sanitized_titles(self, tmp_path):
+        _FakeYoutubeDL.titles = ["Artist - Song (Official Video)"]
+        with patch("main.yt_dlp.YoutubeDL", _FakeYoutubeDL):
+            tracks = asyncio.run(download_audio("https://youtu.be/abc", str(tmp_path)))
+        assert tracks == [
+            {
+                "filepath": str(tmp_path / "Artist - Song.mp3"),
+                "title": "Artist - Song",
+                "playlist": None,
+                "total": 1,
+            }
+        ]
+        assert (tmp_path / "Artist - Song.mp3").is_file()
+
+    def test_playlist_tracks_keep_playlist_order(self, tmp_path):
+        _FakeYoutubeDL.titles = ["First", "Second", "Third"]
+        with patch("main.yt_dlp.YoutubeDL", _FakeYoutubeDL):
+            tracks = asyncio.run(
+                download_audio("https://youtube.com/playlist?list=PL1", str(tmp_path))
+            )
+        assert [t["title"] for t in tracks] == ["First", "Second", "Third"]
+        assert {t["playlist"] for t in tracks} == {"My Playlist"}
+
+    def test_short_link_with_list_downloads_whole_playlist(self, tmp_path):
+        _FakeYoutubeDL.titles = ["First", "Second", "Third"]
+        with patch("main.yt_dlp.YoutubeDL", _FakeYoutubeDL):
+            tracks = asyncio.run(
+                download_audio("https://youtu.be/abc?list=PL1", str(tmp_path))
+            )
+        assert [t["title"] for t in tracks] == ["First", "Second", "Third"]
+        assert {t["playlist"] for t in tracks} == {"My Playlist"}
+
+    def test_playlist_without_list_id_is_not_cached(self, tmp_path):
+        # Matches YOUTUBE_PLAYLIST_RE but has no ``[?&]list=`` parameter.
+        url = "https://youtube.com/playlist?xlist=PL1"
+        assert is_playlist_url(url) and playlist_id(url) is None
+        _FakeYoutubeDL.titles = ["First"]
+        with patch("main.yt_dlp.YoutubeDL", _FakeYoutubeDL), patch(
+            "main.cache"
+        ) as mock_cache:
+            tracks = asyncio.run(download_audio(url, str(tmp_path)))
+        assert [t["title"] for t in tracks] == ["First"]
+        mock_cache.get.assert_not_called()
+        mock_cache.put.assert_not_called()
+
+    def test_colliding_titles_keep_both_files(self, tmp_path):
+        _FakeYoutubeDL.titles = ["Song (HD)", "Song [4K]"]
+        ready = []
+        with patch("main.yt_dlp.YoutubeDL", _FakeYoutubeDL):
+            tracks = asyncio.run(
+                download_audio(
+                    "https://youtube.com/playlist?list=PL1",
+                    str(tmp_path),
+                    on_track_ready=ready.append,
+                )
+            )
+        paths = {t["filepath"] for t in tracks}
+        assert paths == {str(tmp_path / "Song.mp3"), str(tmp_path / "Song (2).mp3")}
+        assert sorted(map(id, ready)) == sorted(map(id, tracks))
+
+    def test_reuses_one_youtubedl_per_thread(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(main, "DOWNLOAD_WORKERS", 1)
+        created = []
+
+        class _Recording(_FakeYoutubeDL):
+            def __init__(self, opts):
+                super().__init__(opts)
+                self.closed = False
+                created.append(self)
+
+            def close(self):
+                self.closed = True
+
+        _FakeYoutubeDL.titles = ["First", "Second", "Third"]
+        with patch("main.yt_dlp.YoutubeDL", _Recording):
+            tracks = asyncio.run(
+                download_audio("https://youtube.com/playlist?list=PL1", str(tmp_path))
+            )
+        assert len(tracks) == 3
+        # One for the listing, one for the single download thread.
+        assert len(created) == 2
+        assert all(ydl.closed for ydl in created)
+
+    def test_long_titles_are_cut_to_filename_limit(self, tmp_path):
+        _FakeYoutubeDL.titles = ["曲" * 100]
+        with patch("main.yt_dlp.YoutubeDL", _FakeYoutubeDL):
+            tracks = asyncio.run(download_audio("https://youtu.be/abc", str(tmp_path)))
+        filename = tracks[0]["filepath"].rsplit("/", 1)[1]
+        assert filename == "曲" * 66 + ".mp3"
+        assert tracks[0]["title"] == "曲" * 100
+
+
+# -----------------------------------------------------------------------
+# ProgressThrottler
+# -----------------------------------------------------------------------
+class TestProgressThrottler:
+    @staticmethod
+    def _message():
+        message = MagicMock()
+        message.edit_text = AsyncMock()
+        return message
+
+    def test_holds_back_edits_within_interval(self):
+        message = self._message()
+
+        async def _run():
+            progress = ProgressThrottler(message, interval=60)
+            await progress.push("one")
+            await progress.push("two")
+            progress.close()
+
+        asyncio.run(_run())
+        message.edit_text.assert_awaited_once_with("one", parse_mode="HTML")
+
+    def test_sends_latest_held_back_text_after_interval(self):
+        message = self._message()
+
+        async def _run():
+            progress = ProgressThrottler(message, interval=0.05)
+            await progress.push("one")
+            await progress.push("two")
+            await progress.push("three")
+            await asyncio.sleep(0.1)
+
+        asyncio.run(_run())
+        assert [c.args[0] for c in message.edit_text.await_args_list] == [
+            "one",
+            "three",
+        ]
+
+    def test_force_bypasses_throttle_and_drops_pending(self):
+        message = self._message()
+
+        async def _run():
+            progress = ProgressThrottler(message, interval=0.05)
+            await progress.push("one")
+            await progress.push("two")
+            await progress.push("done", force=True)
+            await asyncio.sleep(0.1)
+
+        asyncio.run(_run())
+        assert [c.args[0] for c in message.edit_text.await_args_list] == [
+            "one",
+            "done",
+        ]
+
+    @pytest.mark.parametrize("immediate", [False, True], ids=["held-back", "immediate"])
+    def test_forced_edit_lands_after_in_flight_edit(self, immediate):
+        shown = []
+
+        class _SlowMessage:
+            async def edit_text(self, text, **kwargs):
+                # "two" is still on the wire when "done" is forced.
+                await asyncio.sleep(0.1 if text == "two" else 0)
+                shown.append(text)
+
+        async def _run():
+            progress = ProgressThrottler(_SlowMessage(), interval=0.02)
+            await progress.push("one")
+            if immediate:
+                await asyncio.sleep(0.04)
+                # Fire-and-forget, as _dl_progress does from its thread.
+                asyncio.create_task(progress.push("two"))
+                await asyncio.sleep(0)
+            else:
+                await progress.push("two")
+                await asyncio.sleep(0.04)
+            await progress.push("done", force=True)
+            await asyncio.sleep(0.15)
+
+        asyncio.run(_run())
+        assert shown == ["one", "two", "done"]
+
+
+# -----------------------------------------------------------------------
+# handle_message
+# -----------------------------------------------------------------------
+class TestHandleMessage:
+    @staticmethod
+    def _update(text):
+        status = MagicMock()
+        status.edit_text = AsyncMock()
+        update = MagicMock()
+        update.message.text = text
+        update.message.parse_entities.return_value = {}
+        update.message.reply_text = AsyncMock(return_value=status)
+        update.message.reply_audio = AsyncMock()
+        return update, status
+
+    @staticmethod
+    def _edits(status):
+        return [c.args[0] for c in status.edit_text.await_args_list]
+
+    def test_failed_download_leaves_no_uploads_running(self, tmp_path, monkeypatch):
+        key_file = tmp_path / "sa.json"
+        key_file.write_text("{}")
+        monkeypatch.setattr(main, "GOOGLE_DRIVE_FOLDER_ID", "root")
+        monkeypatch.setattr(main, "GOOGLE_SERVICE_ACCOUNT_FILE", str(key_file))
+        monkeypatch.setattr(
+            main, "_upload_executor", concurrent.futures.ThreadPoolExecutor(1)
+        )
+        monkeypatch.setattr(main, "_resolve_folder", lambda name: ("folder", {}))
+
+        upload_started = threading.Event()
+        uploads = []
+
+        def _slow_upload(filepath, folder_id, existing_names):
+            upload_started.set()
+            time.sleep(0.2)
+            uploads.append((filepath, os.path.exists(filepath)))
+            return "id"
+
+        async def _failing_download(url, output_dir, on_track_ready=None, **kwargs):
+            def _work():
+                for i in range(3):
+                    path = os.path.join(output_dir, f"{i}.mp3")
+                    with open(path, "wb") as f:
+                        f.write(b"\x00")
+                    on_track_ready(
+                        {"filepath": path, "title": f"T{i}", "playlist": "P", "total": 3}
+                    )
+                upload_started.wait(1)
+                raise yt_dlp.utils.DownloadError("Video unavailable")
+
+            await asyncio.to_thread(_work)
+
+        monkeypatch.setattr(main, "_upload_track", _slow_upload)
+        monkeypatch.setattr(main, "download_audio", _failing_download)
+        update, status = self._update("https://youtube.com/playlist?list=PL1")
+
+        async def _run():
+            await main.handle_message(update, None)
+            edits_on_return = self._edits(status)
+            await asyncio.sleep(0.3)
+            return edits_on_return
+
+        edits_on_return = asyncio.run(_run())
+        # The running upload finished before its file was removed; the queued
+        # ones never started and nothing edited the message afterwards.
+        assert len(uploads) == 1 and uploads[0][1] is True
+        assert self._edits(status) == edits_on_return
+        assert edits_on_return[-1].startswith("❌ This video is unavailable")
+
+    def test_upload_progress_counts_against_playlist_size(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(main, "_resolve_folder", lambda name: ("folder", {}))
+        monkeypatch.setattr(main, "_upload_track", lambda *args: "id")
+        progress = MagicMock()
+        progress.push = AsyncMock()
+
+        async def _run():
+            queue = asyncio.Queue()
+            for i in range(2):
+                path = tmp_path / f"{i}.mp3"
+                path.write_bytes(b"\x00")
+                queue.put_nowait(
+                    {"filepath": str(path), "title": f"T{i}", "playlist": "P", "total": 40}
+                )
+            queue.put_nowait(None)
+            await main._upload_worker(queue, progress, playlist=True)
+
+        asyncio.run(_run())
+        bars = {c.args[0].split("\n")[1] for c in progress.push.await_args_list}
+        assert bars == {f"{main._bar(1 / 40)} 1/40", f"{main._bar(2 / 40)} 2/40"}
+
+    def test_direct_send_delivers_every_track(self, monkeypatch):
+        monkeypatch.setattr(main, "GOOGLE_DRIVE_FOLDER_ID", "")
+        _FakeYoutubeDL.titles = ["First", "Second", "Third"]
+        update, status = self._update("https://youtube.com/playlist?list=PL1")
+        with patch("main.yt_dlp.YoutubeDL", _FakeYoutubeDL):
+            asyncio.run(main.handle_message(update, None))
+
+        sent = [c.kwargs["title"] for c in update.message.reply_audio.await_args_list]
+        assert sorted(sent) == ["First", "Second", "Third"]
+        assert self._edits(status)[-1].startswith("✅ Done! Files sent directly")
+
+    def test_failed_send_stops_download_and_is_reported(self, monkeypatch):
+        monkeypatch.setattr(main, "GOOGLE_DRIVE_FOLDER_ID", "")
+        monkeypatch.setattr(main, "DOWNLOAD_WORKERS", 1)
+        downloaded = []
+
+        class _SlowYoutubeDL(_FakeYoutubeDL):
+            def extract_info(self, url, download=True):
+                if download:
+                    downloaded.append(url)
+                    time.sleep(0.05)
+                return super().extract_info(url, download)
+
+        _FakeYoutubeDL.titles = [f"Song {i}" for i in range(10)]
+        update, status = self._update("https://youtube.com/playlist?list=PL1")
+        update.message.reply_audio.side_effect = RuntimeError("File too large")
+        with patch("main.yt_dlp.YoutubeDL", _SlowYoutubeDL):
+            asyncio.run(main.handle_message(update, None))
+
+        update.message.reply_audio.assert_awaited_once()
+        assert len(downloaded) < 10
+        assert self._edits(status)[-1] == "⚠️ Sending files failed: File too large"
+
+    def test_failed_upload_stops_download_and_is_reported(self, tmp_path, monkeypatch):
+        key_file = tmp_path / "sa.json"
+        key_file.write_text("{}")
+        monkeypatch.setattr(main, "GOOGLE_DRIVE_FOLDER_ID", "root")
+        monkeypatch.setattr(main, "GOOGLE_SERVICE_ACCOUNT_FILE", str(key_file))
+        monkeypatch.setattr(main, "DOWNLOAD_WORKERS", 1)
+        monkeypatch.setattr(main, "_resolve_folder", lambda name: ("folder", {}))
+        downloaded = []
+
+        def _forbidden(*args):
+            raise RuntimeError("Insufficient permissions")
+
+        class _SlowYoutubeDL(_FakeYoutubeDL):
+            def extract_info(self, url, download=True):
+                if download:
+                    downloaded.append(url)
+                    time.sleep(0.05)
+                return super().extract_info(url, download)
+
+        monkeypatch.setattr(main, "_upload_track", _forbidden)
+        _FakeYoutubeDL.titles = [f"Song {i}" for i in range(10)]
+        update, status = self._update("https://youtube.com/playlist?list=PL1")
+        with patch("main.yt_dlp.YoutubeDL", _SlowYoutubeDL):
+            asyncio.run(main.handle_message(update, None))
+
+        assert len(downloaded) < 10
+        assert (
+            self._edits(status)[-1]
+            == "⚠️ Upload to Google Drive failed: Insufficient permissions"
+        )